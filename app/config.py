@@ -0,0 +1,37 @@
+from dotenv import load_dotenv
+import os
+
+# read .env once for the whole application
+load_dotenv()
+
+# secret key and algorithm to JWT, the app cannot sign tokens without a key
+SECRET_KEY = os.getenv("SECRET_KEY")
+if not SECRET_KEY:
+    raise RuntimeError("SECRET_KEY environment variable is not set")
+SECRET_KEY_BYTES = SECRET_KEY.encode()
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 0.5
+REFRESH_TOKEN_EXPIRE_DAYS = 7
+ACCESS_TOKEN_EXPIRE_SECONDS = int(ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+REFRESH_TOKEN_EXPIRE_SECONDS = REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+
+# Argon2id cost parameters for new password hashes
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+# processes hashing passwords, the KDF is CPU bound
+KDF_WORKERS = int(os.getenv("KDF_WORKERS", os.cpu_count() or 1))
+
+# public address of the app, used in links sent by email
+BASE_URL = os.getenv("BASE_URL")
+
+# SMTP settings for outgoing email
+EMAIL_HOST = os.getenv("EMAIL_HOST")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", "587"))
+EMAIL_USER = os.getenv("EMAIL_USER")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL", "False").lower() == "true"
+# most SMTP sessions open at once, and messages sent over one session
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", "5"))
+EMAIL_MAX_MESSAGES = int(os.getenv("EMAIL_MAX_MESSAGES", "100"))
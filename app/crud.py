@@ -1,134 +1,433 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
-from passlib.context import CryptContext
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import and_, lambda_stmt, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHash
 from datetime import datetime, timedelta
 import time
-from jose import JWTError, jwt
-from dotenv import load_dotenv
+import jwt
+from cachetools import TLRUCache, TTLCache
 from . import models, schemas
-import os
+from .config import (
+    SECRET_KEY_BYTES,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_SECONDS,
+    REFRESH_TOKEN_EXPIRE_SECONDS,
+    ARGON2_TIME_COST,
+    ARGON2_MEMORY_COST,
+    ARGON2_PARALLELISM,
+    KDF_WORKERS,
+)
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import secrets
+import asyncio
+import hashlib
+import hmac
+import orjson
+import base64
+import threading
+import logging
+from functools import lru_cache
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Decoded JWT payloads, keyed by a digest of the token (never the raw token)
+# Entries live until the token expires, but no longer than the cap
+TOKEN_CACHE_TTL_SECONDS = 300
+
+
+def _token_cache_ttu(cache_key, payload, now):
+    """Returns the cache expiry time of a decoded token."""
+    ttl = TOKEN_CACHE_TTL_SECONDS
+    allow_expired = cache_key[1]
+    if not allow_expired:
+        ttl = min(ttl, payload.get("exp", 0) - time.time())
+    return now + ttl
+
+
+_token_cache = TLRUCache(maxsize=10_000, ttu=_token_cache_ttu)
+_token_cache_lock = threading.Lock()
+
+# Refresh tokens known to be valid, as (username, exp) by token digest.
+# Logout drops them in this process, other workers forget them after the TTL
+REFRESH_CACHE_TTL_SECONDS = 60
+_refresh_cache = TTLCache(maxsize=10_000, ttl=REFRESH_CACHE_TTL_SECONDS)
+_refresh_cache_lock = threading.Lock()
+
+# Users behind recently seen access and refresh tokens, as AuthUser
+# snapshots keyed by (token kind, token digest)
+AUTH_USER_CACHE_TTL_SECONDS = 30
+_auth_user_cache = TTLCache(maxsize=10_000, ttl=AUTH_USER_CACHE_TTL_SECONDS)
+_auth_user_cache_lock = threading.Lock()
+
+# Successful password checks, keyed by a keyed digest of the password
+# and the stored hash, so a password change invalidates the entry
+PASSWORD_CACHE_TTL_SECONDS = 600
+_password_cache = TTLCache(maxsize=1024, ttl=PASSWORD_CACHE_TTL_SECONDS)
+_password_cache_lock = threading.Lock()
+_PASSWORD_CACHE_KEY = secrets.token_bytes(32)
+
+# Tunes and proposals listings, shared by all users of the same kind
+LISTING_CACHE_TTL_SECONDS = 15
+_listing_cache = TTLCache(maxsize=16, ttl=LISTING_CACHE_TTL_SECONDS)
+_listing_cache_lock = threading.Lock()
+
+# New hashes use Argon2id, older bcrypt hashes are still accepted
+password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
 
-# read .env
-load_dotenv()
 
-# secret key and algorithm to JWT
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 0.5
-REFRESH_TOKEN_EXPIRE_DAYS = 7
+def hash_password(password: str) -> str:
+    """Hashes the password before storing it in the database."""
+    return password_hasher.hash(password)
 
-# Initialize bcrypt context for hashing passwords
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+def _check_hash(plain: str, hashed: str) -> bool:
+    """Checks a plain value against an Argon2 or a legacy bcrypt hash."""
+    if not hashed.startswith("$argon2"):
+        try:
+            return bcrypt.checkpw(plain.encode(), hashed.encode())
+        except ValueError:
+            # Not a bcrypt hash either, e.g. "Invalid salt"
+            return False
+    try:
+        return password_hasher.verify(hashed, plain)
+    except (VerificationError, InvalidHash):
+        return False
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Checks if the hash is bcrypt or uses outdated Argon2 parameters."""
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
 
-def hash_password(password: str) -> str:
-    """Hashes the password before storing it in the database."""
-    return pwd_context.hash(password)
 
+@lru_cache(maxsize=1)
+def _kdf_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool for password hashing, created on first use.
+    Spawned (not forked) processes, as the app runs scheduler threads.
+    """
+    return ProcessPoolExecutor(
+        max_workers=KDF_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifies if the plain password matches the hashed password."""
-    return pwd_context.verify(plain_password, hashed_password)
 
+def shutdown_kdf_pool():
+    """Stops the password hashing processes, if they were started."""
+    if _kdf_pool.cache_info().currsize:
+        _kdf_pool().shutdown()
+        _kdf_pool.cache_clear()
 
-def get_user_by_username_or_email(
-    db: Session, username: str = None, email: str = None
-):
-    """Fetches a user from the database by either username or email."""
 
-    query = db.query(models.User).filter(
-        or_(models.User.username == username, models.User.email == email)
+def _discard_kdf_pool(pool: ProcessPoolExecutor):
+    """Drops a broken pool, unless it has already been replaced."""
+    if _kdf_pool.cache_info().currsize and _kdf_pool() is pool:
+        _kdf_pool.cache_clear()
+    pool.shutdown(wait=False)
+
+
+async def _run_in_kdf_pool(func, *args):
+    """
+    Runs a KDF call in the process pool. When a worker has died
+    (e.g. killed for memory) the pool is broken for good,
+    so it is replaced and the call retried once.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _kdf_pool()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        logger.warning("Password hashing pool broke, starting a new one")
+        _discard_kdf_pool(pool)
+        return await loop.run_in_executor(_kdf_pool(), func, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    """
+    Hashes the password in the process pool,
+    so the KDF does not block the event loop or the worker's other requests.
+    """
+    return await _run_in_kdf_pool(hash_password, password)
+
+
+def _password_cache_key(plain_password: str, hashed_password: str):
+    """Builds the password cache key, without keeping the plain password."""
+    password_digest = hmac.new(
+        _PASSWORD_CACHE_KEY, plain_password.encode(), hashlib.sha256
+    ).digest()
+    return (password_digest, hashed_password)
+
+
+async def verify_password_async(
+    plain_password: str, hashed_password: str
+) -> bool:
+    """
+    Verifies if the plain password matches the hashed password.
+    Only successful checks are cached, wrong passwords always run the KDF,
+    in the process pool so the event loop is not blocked.
+    """
+    cache_key = _password_cache_key(plain_password, hashed_password)
+
+    with _password_cache_lock:
+        if cache_key in _password_cache:
+            return True
+
+    password_ok = await _run_in_kdf_pool(
+        _check_hash, plain_password, hashed_password
+    )
+    if not password_ok:
+        return False
+
+    with _password_cache_lock:
+        _password_cache[cache_key] = True
+
+    return True
+
+
+def forget_verified_passwords(hashed_password: str):
+    """Drops cached successful checks against the given password hash."""
+    with _password_cache_lock:
+        for cache_key in list(_password_cache):
+            if cache_key[1] == hashed_password:
+                del _password_cache[cache_key]
+
+
+# Throwaway hash for unknown users, built by the startup hook
+_dummy_hash = None
+
+
+async def dummy_password_hash() -> str:
+    """
+    Returns a throwaway hash used to verify passwords of unknown users,
+    so that a missing user takes as long as a wrong password.
+    It is hashed in the process pool, once per worker process.
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await hash_password_async(secrets.token_urlsafe(16))
+    return _dummy_hash
+
+
+def versions_match(expected: int, received) -> bool:
+    """Compares two token versions in constant time."""
+    return hmac.compare_digest(str(expected).encode(), str(received).encode())
+
+
+def get_user_by_username(db: Session, username: str):
+    """Fetches a user from the database by username."""
+    stmt = lambda_stmt(
+        lambda: select(models.User).where(models.User.username == username)
     )
+    return db.execute(stmt).scalars().first()
+
+
+# Columns needed to authenticate a user and issue or check tokens
+_AUTH_COLUMNS = load_only(
+    models.User.id,
+    models.User.username,
+    models.User.email,
+    models.User.password,
+    models.User.is_confirmed,
+    models.User.token_version,
+    models.User.refresh_token_version,
+    models.User.role,
+)
+
+
+def get_user_for_auth(db: Session, username: str):
+    """
+    Fetches a user by username with only the authentication columns loaded.
+    """
+    stmt = lambda_stmt(lambda: select(models.User).options(_AUTH_COLUMNS))
+    stmt += lambda s: s.where(models.User.username == username)
+    return db.execute(stmt).scalars().first()
+
+
+def get_user_by_email(db: Session, email: str):
+    """Fetches a user from the database by email."""
+    stmt = lambda_stmt(
+        lambda: select(models.User).where(models.User.email == email)
+    )
+    return db.execute(stmt).scalars().first()
+
 
-    return query.first()
+# Dialect specific INSERT constructs supporting ON CONFLICT
+_INSERT_BY_DIALECT = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
 
 
-def create_user(db: Session, user_data: schemas.UserRegister):
-    """Creates a new user in the database."""
-    hashed_password = hash_password(user_data.password)
-    db_user = models.User(
-        username=user_data.username,
-        email=user_data.email,
-        password=hashed_password,
+def create_user(
+    db: Session, user_data: schemas.UserRegister, hashed_password: str = None
+):
+    """
+    Creates a new user in the database.
+    Accepts an already hashed password (e.g. from hash_password_async).
+    Returns None if the username or email is already registered.
+    """
+    if hashed_password is None:
+        hashed_password = hash_password(user_data.password)
+
+    # Unique indexes on username and email decide about conflicts,
+    # so no separate existence check is needed
+    insert = _INSERT_BY_DIALECT[db.get_bind().dialect.name]
+    stmt = (
+        insert(models.User)
+        .values(
+            username=user_data.username,
+            email=user_data.email,
+            password=hashed_password,
+        )
+        .on_conflict_do_nothing()
+        .returning(models.User)
     )
+    db_user = db.execute(stmt).scalar_one_or_none()
+
+    # Detach the user before committing, so the commit does not expire
+    # the RETURNING values and reading them needs no further query
+    if db_user is not None:
+        db.expunge(db_user)
 
-    # Add the new user to the session
-    db.add(db_user)
     # Commit the transaction to save the user in the database
     db.commit()
-    # Refresh the instance to get the latest data (e.g., generated ID)
-    db.refresh(db_user)
 
     return db_user
 
 
-def authenticate_user(db: Session, username: str, password: str):
+def _store_password_hash(db: Session, user_id: int, hashed_password: str):
+    """Replaces the stored password hash of a user."""
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(password=hashed_password)
+    )
+    db.commit()
+
+
+def _load_user_for_auth(db: Session, username: str):
+    """
+    Fetches the user to authenticate. When the lookup starts the
+    transaction, it is ended again, so the connection goes back to the
+    pool while the password is checked. The user is detached first,
+    so its loaded columns are not expired.
+    """
+    # The lookup starts a transaction unless the caller already has one,
+    # or has pending changes that must not be rolled back
+    owns_transaction = not (
+        db.in_transaction() or db.new or db.dirty or db.deleted
+    )
+    user = get_user_for_auth(db, username)
+    if owns_transaction:
+        if user is not None:
+            db.expunge(user)
+        db.rollback()
+    return user
+
+
+async def authenticate_user(db: Session, username: str, password: str):
     """
     Authenticates a user by checking if
     the username and password are correct.
     """
-    # Fetch user by username
-    user = get_user_by_username_or_email(db, username=username)
-    # Verify the provided password
-    if user and verify_password(password, user.password):
-        return user
+    # Fetch user by username, the queries run in a worker thread
+    user = await asyncio.to_thread(_load_user_for_auth, db, username)
+    # Verify the provided password, against a dummy hash if there is no user
+    hashed_password = user.password if user else await dummy_password_hash()
+    password_ok = await verify_password_async(password, hashed_password)
     # If user doesn't exist or password is incorrect, return None
-    return None
+    if not (user and password_ok):
+        return None
 
+    # Upgrade legacy bcrypt hashes now that the plain password is known
+    if password_needs_rehash(user.password):
+        forget_verified_passwords(user.password)
+        user.password = await hash_password_async(password)
+        await asyncio.to_thread(
+            _store_password_hash, db, user.id, user.password
+        )
 
-def create_access_token(
-    data: dict,
-    expires_delta: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
-):
-    """Generates JWT token for a user."""
-    to_encode = data.copy()
-    expire = datetime.utcnow() + expires_delta
-    to_encode.update({"exp": expire, "version": data.get("version", 0)})
+    return user
 
-    print("utc_now", datetime.utcnow())
-    print("expires_delta", expires_delta)
-    print("expires", expire)
 
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+def _b64url(data: bytes) -> bytes:
+    """Base64url encoding without padding, as used by JWT."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
 
-    return encoded_jwt
 
+_JWT_HEADER_B64 = _b64url(orjson.dumps({"alg": ALGORITHM, "typ": "JWT"}))
 
-def get_token_expiration(token: str) -> int:
-    """
-    Returns remaining token lifetime in seconds.
-    Returns 0 if token is invalid or expired.
-    """
-    try:
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,
-            algorithms=[ALGORITHM],
-            options={"verify_exp": False},
-        )
 
-        expire_timestamp = payload.get("exp")
+# Keyed HMAC-SHA256 object, copied for every token
+# so the key setup is done only once
+_JWT_SIGNER = hmac.new(SECRET_KEY_BYTES, digestmod=hashlib.sha256)
 
-        print("expire_timestamp", expire_timestamp)
 
-        if not expire_timestamp:
-            return 0
+def _encode_jwt(payload: dict) -> str:
+    """Encodes and signs an HS256 JWT. Decoding is still done by PyJWT."""
+    body = _b64url(orjson.dumps(payload))
+    signing_input = _JWT_HEADER_B64 + b"." + body
 
-        current_timestamp = int(time.time())
+    signer = _JWT_SIGNER.copy()
+    signer.update(signing_input)
 
-        expires_in = expire_timestamp - current_timestamp
+    return (signing_input + b"." + _b64url(signer.digest())).decode()
 
-        print(
-            "[DEBUG] Current:", current_timestamp,
-            "Expires:", expire_timestamp,
-            "Diff:", expires_in
-        )
 
-        return max(0, expires_in)
-    except JWTError as e:
-        print(f"[ERROR] Token validation failed: {str(e)}")
-        return 0
+class _OrjsonJWT(jwt.PyJWT):
+    """PyJWT decoder that parses the payload with orjson."""
+
+    def _decode_payload(self, decoded: dict) -> dict:
+        try:
+            payload = orjson.loads(decoded["payload"])
+        except orjson.JSONDecodeError as e:
+            raise jwt.DecodeError(f"Invalid payload string: {e}")
+        if not isinstance(payload, dict):
+            raise jwt.DecodeError(
+                "Invalid payload string: must be a json object"
+            )
+        return payload
+
+
+_jwt_decoder = _OrjsonJWT()
+
+
+def create_access_token_with_expiry(
+    data: dict, expires_delta: timedelta = None
+):
+    """
+    Generates JWT token for a user.
+    Returns the token and its lifetime in seconds,
+    so callers don't have to decode the token again to learn it.
+    """
+    if expires_delta is None:
+        expires_in = ACCESS_TOKEN_EXPIRE_SECONDS
+    else:
+        expires_in = int(expires_delta.total_seconds())
+
+    token = _encode_jwt(
+        {
+            **data,
+            "exp": int(time.time()) + expires_in,
+            "version": data.get("version", 0),
+        }
+    )
+    return token, expires_in
+
+
+def create_access_token(data: dict, expires_delta: timedelta = None):
+    """Generates JWT token for a user."""
+    return create_access_token_with_expiry(data, expires_delta)[0]
 
 
 def create_refresh_token(user: models.User):
@@ -136,55 +435,138 @@ def create_refresh_token(user: models.User):
     data = {
         "sub": user.username,
         "version": user.refresh_token_version,
-        "exp": datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        "exp": int(time.time()) + REFRESH_TOKEN_EXPIRE_SECONDS,
     }
-    return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
+    return _encode_jwt(data)
+
+
+def _token_digest(token: str) -> bytes:
+    """Short digest used to key caches, so raw tokens are never stored."""
+    return hashlib.sha256(token.encode()).digest()[:16]
 
 
 def verify_token(token: str, allow_expired: bool = False):
     """
     Verifies the JWT token and returns the decoded data,
     even if expired (if allow_expired=True).
+    Decoded payloads are cached until the token expires,
+    so PyJWT's own exp check is the only one needed.
     """
-    try:
-        payload = jwt.decode(
-            token,
-            SECRET_KEY,
-            algorithms=[ALGORITHM],
-            options={"verify_exp": not allow_expired},
-        )
-        print("Decoded payload:", payload)
+    cache_key = (_token_digest(token), allow_expired)
+    with _token_cache_lock:
+        payload = _token_cache.get(cache_key)
+
+    if payload is None:
+        try:
+            payload = _jwt_decoder.decode(
+                token,
+                SECRET_KEY_BYTES,
+                algorithms=[ALGORITHM],
+                options={
+                    "verify_exp": not allow_expired,
+                    "require": ["exp", "sub"],
+                },
+            )
+        except jwt.PyJWTError:
+            return None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Decoded payload: %s", payload)
+
+        with _token_cache_lock:
+            _token_cache[cache_key] = payload
+
+    return payload
 
-        if not allow_expired:
-            exp_datetime = datetime.fromtimestamp(payload["exp"])
-            if exp_datetime < datetime.utcnow():
-                return None
 
-        return payload
+def verify_refresh_token(token: str, db: Session):
+    """Verifies a refresh token and ensures it is still valid."""
+    payload = verify_token(token)
+    if not payload:
+        return None
+
+    username = payload.get("sub")
+    version = payload.get("version")
 
-    except JWTError:
+    if not username or version is None:
         return None
 
+    user = get_user_for_auth(db, username)
+    if not user or not versions_match(user.refresh_token_version, version):
+        return None
 
-def verify_refresh_token(token: str, db: Session):
-    """Verifies a refresh token and ensures it is still valid."""
+    return user
+
+
+def rotate_refresh_token(token: str, db: Session):
+    """
+    Verifies a refresh token and retires it in one UPDATE ... RETURNING.
+    Returns the username and new token versions, or None if the token
+    is invalid or was already used.
+    """
     payload = verify_token(token)
     if not payload:
         return None
 
     username = payload.get("sub")
     version = payload.get("version")
-
     if not username or version is None:
         return None
 
-    user = get_user_by_username_or_email(db, username=username)
-    if not user or user.refresh_token_version != version:
+    user = db.execute(
+        update(models.User)
+        .where(
+            models.User.username == username,
+            models.User.refresh_token_version == version,
+        )
+        .values(refresh_token_version=models.User.refresh_token_version + 1)
+        .returning(
+            models.User.username,
+            models.User.token_version,
+            models.User.refresh_token_version,
+            models.User.role,
+        )
+    ).one_or_none()
+    if user is None:
+        db.rollback()
         return None
 
+    db.commit()
+    _forget_refresh_tokens(username)
+    _forget_auth_users(username)
+
     return user
 
 
+def refresh_token_is_valid(token: str, db: Session) -> bool:
+    """
+    Checks a refresh token like verify_refresh_token, without returning
+    the user. Valid tokens are remembered, so repeat checks skip the DB.
+    """
+    cache_key = _token_digest(token)
+    with _refresh_cache_lock:
+        entry = _refresh_cache.get(cache_key)
+    if entry and entry[1] > time.time():
+        return True
+
+    user = verify_refresh_token(token, db)
+    if not user:
+        return False
+
+    expire_timestamp = verify_token(token)["exp"]
+    with _refresh_cache_lock:
+        _refresh_cache[cache_key] = (user.username, expire_timestamp)
+
+    return True
+
+
+def _forget_refresh_tokens(username: str):
+    """Drops remembered refresh tokens of the user."""
+    with _refresh_cache_lock:
+        for cache_key, entry in list(_refresh_cache.items()):
+            if entry[0] == username:
+                del _refresh_cache[cache_key]
+
+
 def get_logged_in_user(db: Session, token: str):
     """Verifies the token and fetches the logged-in user from the database."""
     token_data = verify_token(token, allow_expired=True)  # <--- key change
@@ -196,19 +578,171 @@ def get_logged_in_user(db: Session, token: str):
     if not username or token_version is None:
         return None
 
-    user = get_user_by_username_or_email(db, username=username)
-    if not user or user.token_version != token_version:
+    user = get_user_for_auth(db, username)
+    if not user or not versions_match(user.token_version, token_version):
         return None
 
     return user
 
 
+class AuthUser(NamedTuple):
+    """Detached copy of the user columns the endpoints read."""
+
+    id: int
+    username: str
+    email: str
+    role: str
+    token_version: int
+    refresh_token_version: int
+
+
+def _auth_user_snapshot(user: models.User) -> AuthUser:
+    return AuthUser(
+        user.id,
+        user.username,
+        user.email,
+        user.role,
+        user.token_version,
+        user.refresh_token_version,
+    )
+
+
+def _cached_auth_user(kind: str, token: str, db: Session, lookup):
+    """
+    Returns the user behind a token as an AuthUser, reusing
+    the result of a recent lookup of the same token.
+    """
+    cache_key = (kind, _token_digest(token))
+    with _auth_user_cache_lock:
+        user = _auth_user_cache.get(cache_key)
+    if user is not None:
+        return user
+
+    db_user = lookup(token, db)
+    if not db_user:
+        return None
+
+    user = _auth_user_snapshot(db_user)
+    with _auth_user_cache_lock:
+        _auth_user_cache[cache_key] = user
+    return user
+
+
+def get_logged_in_user_cached(db: Session, token: str):
+    """
+    Like get_logged_in_user, but returns a cached AuthUser.
+    For read-only use, endpoints changing the user need the ORM object.
+    """
+    return _cached_auth_user(
+        "access", token, db, lambda t, s: get_logged_in_user(s, t)
+    )
+
+
+def get_logged_in_user_and_tune(db: Session, token: str, tune_id: int):
+    """
+    Returns the cached AuthUser of the token and the tune.
+    When the user is not cached, both are fetched in one query.
+    The user is None for an invalid token, the tune None if it is missing.
+    """
+    cache_key = ("access", _token_digest(token))
+    with _auth_user_cache_lock:
+        user = _auth_user_cache.get(cache_key)
+    if user is not None:
+        return user, get_tune_by_id(db, tune_id)
+
+    token_data = verify_token(token, allow_expired=True)
+    if not token_data:
+        return None, None
+
+    username = token_data.get("sub")
+    token_version = token_data.get("version")
+    if not username or token_version is None:
+        return None, None
+
+    stmt = lambda_stmt(
+        lambda: select(models.User, models.Tunes)
+        .options(_AUTH_COLUMNS)
+        .outerjoin(models.Tunes, models.Tunes.id == tune_id)
+        .where(models.User.username == username)
+    )
+    row = db.execute(stmt).first()
+    if not row or not versions_match(row[0].token_version, token_version):
+        return None, None
+
+    user = _auth_user_snapshot(row[0])
+    with _auth_user_cache_lock:
+        _auth_user_cache[cache_key] = user
+    return user, row[1]
+
+
+def verify_refresh_token_cached(token: str, db: Session):
+    """Like verify_refresh_token, but returns a cached AuthUser."""
+    return _cached_auth_user("refresh", token, db, verify_refresh_token)
+
+
+def _forget_auth_users(username: str):
+    """Drops cached token lookups of the user."""
+    with _auth_user_cache_lock:
+        for cache_key, user in list(_auth_user_cache.items()):
+            if user.username == username:
+                del _auth_user_cache[cache_key]
+
+
 def logout_user(db: Session, user: models.User):
     """Increments the token version, effectively invalidating old tokens."""
+    # Read before the commit expires the user, to avoid reloading it
+    username, hashed_password = user.username, user.password
     user.token_version += 1
     user.refresh_token_version += 1
     db.commit()
 
+    forget_verified_passwords(hashed_password)
+    _forget_refresh_tokens(username)
+    _forget_auth_users(username)
+
+
+def _cached_listing(db: Session, key: str, stmt):
+    """
+    Returns rows of a listing statement,
+    served from the listing cache while it is fresh.
+    """
+    with _listing_cache_lock:
+        records = _listing_cache.get(key)
+
+    if records is None:
+        records = db.execute(stmt).all()
+        with _listing_cache_lock:
+            _listing_cache[key] = records
+
+    return records
+
+
+def clear_listing_cache(prefix: str = ""):
+    """Drops cached listings, e.g. after a tune has been added or changed."""
+    with _listing_cache_lock:
+        for key in list(_listing_cache):
+            if key.startswith(prefix):
+                del _listing_cache[key]
+
+
+# Listing statements are built once and reused by every request
+_TUNES_STMT = select(
+    models.Tunes.id,
+    models.Tunes.title,
+    models.Tunes.composer,
+    models.Tunes.rhythm,
+    models.Tunes.link,
+    models.Tunes.description,
+    models.Tunes.demo,
+    models.Tunes.progress,
+)
+_READY_TUNES_STMT = _TUNES_STMT.where(
+    and_(models.Tunes.link != "", models.Tunes.progress > 89)
+)
+_DEMO_TUNES_STMT = _TUNES_STMT.where(
+    models.Tunes.demo.is_(True), models.Tunes.link.isnot(None)
+)
+
 
 def get_tunes_table_content(
     db: Session, user_authenticated: bool, is_admin: bool
@@ -217,47 +751,32 @@ def get_tunes_table_content(
     Shows content of music table based on user role
     and authentication status.
     """
-    query = db.query(
-        models.Tunes.id,
-        models.Tunes.title,
-        models.Tunes.composer,
-        models.Tunes.rhythm,
-        models.Tunes.link,
-        models.Tunes.description,
-        models.Tunes.demo,
-        models.Tunes.progress,
-    )
-
     if is_admin:
         # Admins see all tunes
-        records = query.all()
+        return _cached_listing(db, "tunes:admin", _TUNES_STMT)
     elif user_authenticated:
-        records = (
-            db.query(models.Tunes)
-            .filter(and_(models.Tunes.link != "", models.Tunes.progress > 89))
-            .all()
-        )
+        return _cached_listing(db, "tunes:ready", _READY_TUNES_STMT)
     else:
         # Unauthenticated users see only tunes with demo = True
-        records = query.filter(
-            models.Tunes.demo.is_(True), models.Tunes.link.isnot(None)
-        ).all()
-
-    return records
+        return _cached_listing(db, "tunes:demo", _DEMO_TUNES_STMT)
 
 
 def get_tune_by_id(db: Session, tune_id: int):
     """Gets tune based on its ID"""
-    return db.query(models.Tunes).filter(models.Tunes.id == tune_id).first()
+    stmt = lambda_stmt(
+        lambda: select(models.Tunes).where(models.Tunes.id == tune_id)
+    )
+    return db.execute(stmt).scalars().first()
 
 
 def get_demotune_by_id(db: Session, tune_id: int):
     """Gets demo tune based on its ID"""
-    return (
-        db.query(models.Tunes)
-        .filter(models.Tunes.id == tune_id, models.Tunes.demo)
-        .first()
+    stmt = lambda_stmt(
+        lambda: select(models.Tunes).where(
+            models.Tunes.id == tune_id, models.Tunes.demo
+        )
     )
+    return db.execute(stmt).scalars().first()
 
 
 def create_proposal(
@@ -273,25 +792,24 @@ def create_proposal(
     db.add(new_proposal)
     db.commit()
     db.refresh(new_proposal)
+    clear_listing_cache("proposals")
 
     return new_proposal
 
 
+_PROPOSALS_STMT = select(
+    models.Proposals.user_id,
+    models.Proposals.title,
+    models.Proposals.composer,
+    models.Proposals.info,
+    models.User.username,
+    models.User.email,
+).join(models.User, models.Proposals.user_id == models.User.id)
+
+
 def get_proposal_content(db: Session):
     """Shows content of proposals"""
-    records = (
-        db.query(
-            models.Proposals.user_id,
-            models.Proposals.title,
-            models.Proposals.composer,
-            models.Proposals.info,
-            models.User.username,
-            models.User.email,
-        )
-        .join(models.User, models.Proposals.user_id == models.User.id)
-        .all()
-    )
-    return records
+    return _cached_listing(db, "proposals", _PROPOSALS_STMT)
 
 
 def create_tune(db: Session, tune_data: schemas.TuneCreate):
@@ -309,79 +827,78 @@ def create_tune(db: Session, tune_data: schemas.TuneCreate):
     db.add(new_tune)
     db.commit()
     db.refresh(new_tune)
+    clear_listing_cache("tunes")
 
     return new_tune
 
 
 def update_tune(db: Session, tune_id: int, tune_data: schemas.TuneUpdate):
     """Updates existing tune based on id"""
-    tune = db.query(models.Tunes).filter(models.Tunes.id == tune_id).first()
+    # Only the fields that were sent with a value are changed
+    changes = tune_data.dict(exclude_none=True)
+    if not changes:
+        return get_tune_by_id(db, tune_id)
+
+    tune = db.execute(
+        update(models.Tunes)
+        .where(models.Tunes.id == tune_id)
+        .values(**changes)
+        .returning(models.Tunes)
+    ).scalar_one_or_none()
 
     if not tune:
         return None
 
-    if tune_data.title is not None:
-        tune.title = tune_data.title
-    if tune_data.composer is not None:
-        tune.composer = tune_data.composer
-    if tune_data.rhythm is not None:
-        tune.rhythm = tune_data.rhythm
-    if tune_data.difficulty is not None:
-        tune.difficulty = tune_data.difficulty
-    if tune_data.progress is not None:
-        tune.progress = tune_data.progress
-    if tune_data.link is not None:
-        tune.link = tune_data.link
-    if tune_data.description is not None:
-        tune.description = tune_data.description
-    if tune_data.demo is not None:
-        tune.demo = tune_data.demo
-
     db.commit()
-    db.refresh(tune)
+    clear_listing_cache("tunes")
 
     return tune
 
 
-def remove_unconfirmed_users(db: Session):
+def remove_unconfirmed_users(db: Session) -> int:
     """
     Removes unconfirmed users
     who have not confirmed their email within 1 hour.
+    Returns the number of removed users.
     """
     # one_hour_ago = datetime.utcnow() - timedelta(hours=1)
     one_hour_ago = datetime.utcnow() - timedelta(minutes=1)  # TEMP
-    print(f"Current time (UTC): {datetime.utcnow()}")
-    print(f"One hour ago (UTC): {one_hour_ago}")
-    unconfirmed_users = (
+
+    # Single DELETE statement instead of loading and deleting row by row
+    deleted = (
         db.query(models.User)
         .filter(
             models.User.is_confirmed.is_(False),
             models.User.created_at < one_hour_ago,
         )
-        .all()
+        .delete(synchronize_session=False)
     )
+    db.commit()
 
-    print("len unconfirmed users:", len(unconfirmed_users))
+    logger.debug("Removed %d unconfirmed users", deleted)
 
-    for user in unconfirmed_users:
-        db.delete(user)
+    return deleted
 
-    db.commit()
+
+def _hash_reset_token(reset_token: str) -> str:
+    """
+    Keyed SHA-256 of a reset token. The token is random enough already,
+    so a slow password KDF is not needed.
+    """
+    return hmac.new(
+        SECRET_KEY_BYTES, reset_token.encode(), hashlib.sha256
+    ).hexdigest()
 
 
 def generate_reset_token(db: Session, email: str):
     """Creates a password reset token and saves it in the database"""
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = get_user_by_email(db, email)
 
     if not user:
         return None
 
-    user.reset_token = None
-    user.reset_token_expiry = None
-    db.commit()
-
     reset_token = secrets.token_urlsafe(32)  # safe unique token
-    hashed_token = pwd_context.hash(reset_token)
+    hashed_token = _hash_reset_token(reset_token)
 
     expiry_time = datetime.utcnow() + timedelta(hours=1)  # valid for 1 h
 
@@ -396,9 +913,10 @@ def generate_reset_token(db: Session, email: str):
 
 def verify_reset_token(db: Session, token: str):
     """Checks if reset token is valid"""
+    # Stored tokens are deterministic hashes, so they can be looked up directly
     user = (
         db.query(models.User)
-        .filter(models.User.reset_token.isnot(None))
+        .filter(models.User.reset_token == _hash_reset_token(token))
         .first()
     )
 
@@ -409,8 +927,15 @@ def verify_reset_token(db: Session, token: str):
     ):
         return None
 
-    # hashed token verification
-    if not pwd_context.verify(token, user.reset_token):
-        return None
-
     return user
+
+
+def update_password(db: Session, user: models.User, new_password: str):
+    """Saves a new password for the user and removes the used reset token."""
+    forget_verified_passwords(user.password)
+
+    user.password = hash_password(new_password)
+    user.reset_token = None
+    user.reset_token_expiry = None
+
+    db.commit()
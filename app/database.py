@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from .models import Base
 import os
@@ -14,12 +15,67 @@ DB_NAME = os.getenv("DB_NAME")
 DB_HOST = os.getenv("DB_HOST", "db")  # Default host
 DB_PORT = os.getenv("DB_PORT", "5432")  # Default PostgreSQL port
 
-# Construct the database URL
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}"
-DATABASE_URL += f":{DB_PORT}/{DB_NAME}"
+# Construct the database URL, unless a full one is given (e.g. SQLite)
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}"
+    DATABASE_URL += f":{DB_PORT}/{DB_NAME}"
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+# Seconds to wait for a free connection before giving up with an error
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "2"))
+# Connections opened at startup, so the first requests skip the connect
+DB_POOL_WARM_SIZE = int(os.getenv("DB_POOL_WARM_SIZE", "5"))
+# Number of compiled SQL statements kept for reuse
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+
+# In-memory SQLite uses SingletonThreadPool, which takes no sizing
+_url = make_url(DATABASE_URL)
+IS_MEMORY_SQLITE = IS_SQLITE and (
+    _url.database in (None, "", ":memory:")
+    or _url.query.get("mode") == "memory"
+)
+if IS_MEMORY_SQLITE:
+    _pool_sizing = {}
+else:
+    _pool_sizing = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
 
 # Create the SQLAlchemy engine for the database
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    **_pool_sizing,
+    pool_pre_ping=True,  # drop dead connections before handing them out
+    pool_recycle=DB_POOL_RECYCLE,
+    query_cache_size=DB_QUERY_CACHE_SIZE,
+    # SQLite connections are shared between the pool's threads
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+)
+
+
+if IS_SQLITE:
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """
+        WAL lets readers and a writer work at the same time,
+        mmap reads pages without a syscall per page.
+        """
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
 # Create a sessionmaker factory for database sessions
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -27,6 +83,26 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create all database tables based on the models
 Base.metadata.create_all(bind=engine)
 
+
+def warm_up_pool(size: int = DB_POOL_WARM_SIZE):
+    """
+    Opens pool connections ahead of the first requests.
+    They are all held at once, otherwise the pool would reuse one.
+    """
+    if IS_MEMORY_SQLITE:
+        return  # one connection per thread, nothing to open ahead
+
+    connections = []
+    try:
+        for _ in range(min(size, DB_POOL_SIZE)):
+            connection = engine.connect()
+            connection.exec_driver_sql("SELECT 1")
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+
+
 # Dependency to manage database sessions in FastAPI
 
 
@@ -0,0 +1,40 @@
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.orm import Session
+from . import crud, database
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
+# Dependencies resolving the user behind the bearer token.
+# FastAPI runs each of them once per request, even when shared.
+
+
+def current_optional_user(
+    token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
+):
+    """Returns the logged-in user, or None for an invalid token."""
+    return crud.get_logged_in_user_cached(db, token)
+
+
+def current_user(user=Depends(current_optional_user)) -> crud.AuthUser:
+    """Returns the logged-in user, or responds with 401."""
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return user
+
+
+def current_admin(
+    token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
+) -> crud.AuthUser:
+    """Returns the logged-in admin, or responds with 403."""
+    # Access tokens carry the role, so other users are turned away
+    # before any lookup. The user is still checked for admins.
+    payload = crud.verify_token(token, allow_expired=True)
+    user = None
+    if payload and payload.get("role", "admin") == "admin":
+        user = crud.get_logged_in_user_cached(db, token)
+    if not user or user.role != "admin":
+        raise HTTPException(
+            status_code=403, detail="Admin privileges required"
+        )
+    return user
@@ -1,32 +1,40 @@
 from fastapi import FastAPI, Request, Depends
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import (
+    JSONResponse,
+    HTMLResponse,
+    ORJSONResponse,
+    RedirectResponse,
+)
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi import HTTPException
 from .routes import users
 from pydantic import ValidationError
-from apscheduler.schedulers.background import BackgroundScheduler
-from app.database import SessionLocal, get_db
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from starlette.concurrency import run_in_threadpool
+from app.database import SessionLocal, get_db, warm_up_pool
+from app.utils.sending_email import close_smtp
 from sqlalchemy.orm import Session
 from app.crud import (
     remove_unconfirmed_users,
     get_tunes_table_content,
     get_demotune_by_id,
-    verify_refresh_token,
+    refresh_token_is_valid,
+    shutdown_kdf_pool,
+    dummy_password_hash,
 )
 from datetime import datetime
+import logging
 
 
-# TEMPORARY
-print("system timestamp:", datetime.utcnow().timestamp())
-print("utcnow:", datetime.utcnow())
+logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-# Initialize FastAPI app
-app = FastAPI()
+# Initialize FastAPI app, JSON responses are encoded with orjson
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Include the user-related routes with a specific prefix and tags
 app.include_router(users.router, prefix="/users", tags=["users"])
@@ -44,7 +52,7 @@ async def validation_exception_handler(request: Request, exc: ValidationError):
 
 
 @app.get("/", response_class=HTMLResponse)
-async def serve_homepage(request: Request, db: Session = Depends(get_db)):
+def serve_homepage(request: Request, db: Session = Depends(get_db)):
     """
     Checks if a user is logged in by verifying the `refresh_token`
     from cookies. If so, it redirects the user to /users/logged.
@@ -53,21 +61,40 @@ async def serve_homepage(request: Request, db: Session = Depends(get_db)):
     refresh_token = request.cookies.get("refresh_token")
 
     # If the token exists in cookies, try to verify it
-    if refresh_token:
-        user = verify_refresh_token(refresh_token, db)
-        # If the token is valid and assigned to a user, redirect
-        if user:
-            # We use status_code=307 (Temporary Redirect) to make the browser
-            # repeat the GET request at the new address.
-            return RedirectResponse(url="/users/logged", status_code=307)
+    # If the token is valid and assigned to a user, redirect
+    if refresh_token and refresh_token_is_valid(refresh_token, db):
+        # We use status_code=307 (Temporary Redirect) to make the browser
+        # repeat the GET request at the new address.
+        return RedirectResponse(url="/users/logged", status_code=307)
 
     # If the user is not logged in (no token or it's invalid),
     # display the standard homepage with forms.
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+# Last rendered demo page: (base url, listing rows, encoded html)
+_demo_page = None
+
+
+def _render_demo(request: Request, music_entries) -> bytes:
+    """
+    Renders the demo page once and reuses it for as long as the
+    listing cache hands out the same rows for the same base url.
+    """
+    global _demo_page
+    base_url = str(request.base_url)
+    page = _demo_page
+    if page is None or page[0] != base_url or page[1] is not music_entries:
+        html = templates.get_template("demo.html").render(
+            request=request, demo_tunes=music_entries
+        )
+        page = (base_url, music_entries, html.encode())
+        _demo_page = page
+    return page[2]
+
+
 @app.get("/demo")
-async def get_demo(request: Request, db: Session = Depends(get_db)):
+def get_demo(request: Request, db: Session = Depends(get_db)):
     # demo is available for everyone
     user_authenticated = False
     is_admin = False
@@ -77,15 +104,16 @@ async def get_demo(request: Request, db: Session = Depends(get_db)):
     # if not music_entries:
     #     raise HTTPException(status_code=404, detail="No music records found")
 
-    return templates.TemplateResponse(
-        "demo.html", {"request": request, "demo_tunes": music_entries}
+    return HTMLResponse(
+        _render_demo(request, music_entries),
+        headers={"Cache-Control": "public, max-age=60"},
     )
 
 
 @app.get(
     "/demodetails/{tune_id}", name="demodetails", response_class=HTMLResponse
 )
-async def tune_details(
+def tune_details(
     request: Request, tune_id: int, db: Session = Depends(get_db)
 ):
     tune = get_demotune_by_id(db, tune_id)
@@ -97,14 +125,13 @@ async def tune_details(
     )
 
 
-# Initialize the scheduler
-scheduler = BackgroundScheduler()
+# Initialize the scheduler on the application's event loop
+scheduler = AsyncIOScheduler()
 
 # Function to remove unconfirmed users with a database session
 
 
-def scheduled_remove_unconfirmed_users():
-    print(f"Scheduler running at {datetime.utcnow()}")
+def _remove_unconfirmed_users():
     db = SessionLocal()
     try:
         remove_unconfirmed_users(db)
@@ -112,14 +139,30 @@ def scheduled_remove_unconfirmed_users():
         db.close()
 
 
+async def scheduled_remove_unconfirmed_users():
+    logger.debug("Scheduler running at %s", datetime.utcnow())
+    # The cleanup uses a sync session, keep it off the event loop
+    await run_in_threadpool(_remove_unconfirmed_users)
+
+
 # Add the job to the scheduler
 # scheduler.add_job(scheduled_remove_unconfirmed_users, "interval", minutes=30)
 scheduler.add_job(
     scheduled_remove_unconfirmed_users, "interval", minutes=2
 )  # TEMP
-scheduler.start()
+
+
+@app.on_event("startup")
+async def startup_event():
+    await run_in_threadpool(warm_up_pool)
+    # The first unknown-user login must not pay for building the dummy hash
+    await dummy_password_hash()
+    scheduler.start()
 
 
 @app.on_event("shutdown")
-def shutdown_event():
-    scheduler.shutdown()
+async def shutdown_event():
+    if scheduler.running:
+        scheduler.shutdown()
+    shutdown_kdf_pool()
+    await close_smtp()
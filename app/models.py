@@ -1,4 +1,12 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    ForeignKey,
+    DateTime,
+    Index,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
@@ -21,11 +29,16 @@ class User(Base):
     refresh_token_version = Column(Integer, default=0)
     role = Column(String, default="user")
 
-    reset_token = Column(String, nullable=True, unique=True)
+    reset_token = Column(String, nullable=True, unique=True, index=True)
     reset_token_expiry = Column(DateTime, nullable=True)
 
     proposals = relationship("Proposals", back_populates="user")
 
+    __table_args__ = (
+        # Used by the scheduled removal of unconfirmed users
+        Index("ix_users_unconfirmed", "is_confirmed", "created_at"),
+    )
+
 
 class Tunes(Base):
     __tablename__ = "tunes"
@@ -34,18 +47,21 @@ class Tunes(Base):
     composer = Column(String)
     rhythm = Column(String)
     difficulty = Column(Integer)
-    progress = Column(Integer)
+    progress = Column(Integer, index=True)
     link = Column(String)
     description = Column(String)
-    demo = Column(Boolean, default=False)
+    demo = Column(Boolean, default=False, index=True)
 
 
 class Proposals(Base):
     __tablename__ = "proposals"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(
+        Integer, ForeignKey("users.id"), nullable=False, index=True
+    )
     title = Column(String, nullable=False)
     composer = Column(String)
     info = Column(String)
 
-    user = relationship("User", back_populates="proposals")
+    # Authors of a list of proposals are loaded in one extra query
+    user = relationship("User", back_populates="proposals", lazy="selectin")
@@ -1,62 +1,93 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    HTTPException,
+    Depends,
+    Request,
+    Form,
+)
+from fastapi.responses import (
+    HTMLResponse,
+    ORJSONResponse,
+    RedirectResponse,
+    Response,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
 from .. import schemas, crud, database
+from ..deps import (
+    oauth2_scheme,
+    current_user,
+    current_admin,
+    current_optional_user,
+)
 from app.utils.sending_email import (
     send_confirmation_email,
     send_reset_password_email,
 )
-import os
 from datetime import timedelta
 from app.crud import generate_reset_token
+from app.config import BASE_URL
 from pydantic.error_wrappers import ValidationError
-from pydantic import EmailStr
-import json
-import httpx
+import hashlib
+import logging
+import orjson
 
 
-BASE_URL = os.getenv("BASE_URL")
+logger = logging.getLogger(__name__)
 
 
 # Initialize the APIRouter instance for user-related endpoints
 router = APIRouter()
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-
 # Statis files and templates settings
 router.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
+# Page templates, loaded once instead of looked up on every render
+_PAGES = {
+    name: templates.get_template(name)
+    for name in (
+        "index.html",
+        "confirmation.html",
+        "confirmed.html",
+        "tunes.html",
+        "details.html",
+    )
+}
+
+
+def _render_page(name: str, request: Request, **context) -> HTMLResponse:
+    """Renders a preloaded page template into an HTML response."""
+    return HTMLResponse(_PAGES[name].render(request=request, **context))
+
 
 @router.post("/register")  # to be deleted?
 async def register_user(
-    user: schemas.UserRegister, db: Session = Depends(database.get_db)
+    user: schemas.UserRegister,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db),
 ):
     """
     Endpoint to register a new user.
-    Checks if the username or email already exists before creating a new user.
-    If the user exists, it raises an HTTP 400 error.
+    If the username or email already exists, it raises an HTTP 400 error.
     If the user is successfully created,
     it returns a success message with the user's ID.
     """
-    # Check if the user with the same username or email already exists
-    existing_user = crud.get_user_by_username_or_email(
-        db, user.username, user.email
+    # hash the password outside the event loop and create a new user
+    hashed_password = await crud.hash_password_async(user.password)
+    new_user = await run_in_threadpool(
+        crud.create_user, db, user, hashed_password
     )
 
     # If user already exists, raise a 400 error with a message
-    if existing_user:
+    if not new_user:
         raise HTTPException(
             status_code=400, detail="Username or email already registered"
         )
 
-    # create a new user
-    new_user = crud.create_user(db, user)
-
     # create a token what will be valid for 1 hour
     confirmation_token = crud.create_access_token(
         data={"sub": user.username}, expires_delta=timedelta(hours=1)
@@ -65,10 +96,12 @@ async def register_user(
     # create a confirmation link that will appear in the email
     confirmation_link = f"{BASE_URL}/users/confirm?token={confirmation_token}"
 
-    await send_confirmation_email(user.email, confirmation_link)
+    # the email is sent after the response, SMTP latency is not awaited
+    background_tasks.add_task(
+        send_confirmation_email, user.email, confirmation_link
+    )
 
-    print(f"User {new_user.username} registered successfully.")
-    print(f"User id: {new_user.id}")
+    logger.debug("User %s registered, id %s", new_user.username, new_user.id)
 
     return schemas.UserResponse.from_orm(new_user)
 
@@ -76,8 +109,9 @@ async def register_user(
 @router.post("/registered", response_class=HTMLResponse)
 async def register_user_from_form(
     request: Request,
+    background_tasks: BackgroundTasks,
     username: str = Form(...),
-    email: EmailStr = Form(...),
+    email: schemas.CachedEmailStr = Form(...),
     password: str = Form(...),
     password2: str = Form(...),
     db: Session = Depends(database.get_db),
@@ -93,23 +127,26 @@ async def register_user_from_form(
     if not (username and email and password and password2):
         error_message = "All fields must be filled in."
         errors.append(error_message)
-        return templates.TemplateResponse(
-            "index.html", {"request": request, "errors": errors}
-        )
+        return _render_page("index.html", request, errors=errors)
 
     if password != password2:
         error_message = "Passwords do not match"
         errors.append(error_message)
-        return templates.TemplateResponse(
-            "index.html", {"request": request, "errors": errors}
-        )
+        return _render_page("index.html", request, errors=errors)
 
     try:
         # Creating a temporary object to verify validators from schemas.py
         user_data = schemas.UserRegister(
             username=username, email=email, password=password
         )
-        crud.create_user(db, user_data)
+        hashed_password = await crud.hash_password_async(password)
+        new_user = await run_in_threadpool(
+            crud.create_user, db, user_data, hashed_password
+        )
+
+        if not new_user:
+            errors.append("Email/Username already registered.")
+            return _render_page("index.html", request, errors=errors)
 
         confirmation_token = crud.create_access_token(
             data={"sub": username}, expires_delta=timedelta(hours=1)
@@ -118,28 +155,17 @@ async def register_user_from_form(
             f"{BASE_URL}/users/confirm?token={confirmation_token}"
         )
 
-        await send_confirmation_email(email, confirmation_link)
-
-        return templates.TemplateResponse(
-            "confirmation.html", {"request": request, "email": email}
+        background_tasks.add_task(
+            send_confirmation_email, email, confirmation_link
         )
 
-    except ValidationError as e:
-        errors_list = json.loads(e.json())
-        for item in errors_list:
-            errors.append(item.get("msg"))
-        print(errors)
-        return templates.TemplateResponse(
-            "index.html", {"request": request, "errors": errors}
-        )
+        return _render_page("confirmation.html", request, email=email)
 
-    except IntegrityError:
-        # Handle unique constraint violation error
-        db.rollback()
-        errors.append("Email/Username already registered.")
-        return templates.TemplateResponse(
-            "index.html", {"request": request, "errors": errors}
-        )
+    except ValidationError as e:
+        for item in e.errors():
+            errors.append(item["msg"])
+        logger.debug("Registration form errors: %s", errors)
+        return _render_page("index.html", request, errors=errors)
 
 
 @router.post("/login")
@@ -152,7 +178,7 @@ async def login_user(
     If data is incorrect or user is not confirmed, returns HTTP error.
     """
     # Authenticate the user based on username and password
-    authenticated_user = crud.authenticate_user(
+    authenticated_user = await crud.authenticate_user(
         db, user.username, user.password
     )
 
@@ -173,7 +199,11 @@ async def login_user(
 
     # Generate JWT access token for the logged-in user
     access_token = crud.create_access_token(
-        data={"sub": user.username, "version": current_token_version}
+        data={
+            "sub": user.username,
+            "version": current_token_version,
+            "role": authenticated_user.role,
+        }
     )
 
     # Generate refresh token for the user
@@ -198,55 +228,48 @@ async def login_user_from_form(
     errors_login = []
 
     # Authenticate user
-    authenticated_user = crud.authenticate_user(
+    authenticated_user = await crud.authenticate_user(
         db, username=username, password=password
     )
 
     if not authenticated_user:
         errors_login.append("Incorrect email or password")
-        return templates.TemplateResponse(
-            "index.html", {"request": request, "errors_login": errors_login}
-        )
+        return _render_page("index.html", request, errors_login=errors_login)
 
     # Check if user confirmed email
     if not authenticated_user.is_confirmed:
         errors_login.append("Please confirm your email before logging in")
-        return templates.TemplateResponse(
-            "index.html", {"request": request, "errors_login": errors_login}
-        )
+        return _render_page("index.html", request, errors_login=errors_login)
 
     # Get current token version
     current_token_version = authenticated_user.token_version
 
     # Generate JWT tokens
-    access_token = crud.create_access_token(
-        data={"sub": username, "version": current_token_version}
+    access_token, expires_in = crud.create_access_token_with_expiry(
+        data={
+            "sub": username,
+            "version": current_token_version,
+            "role": authenticated_user.role,
+        }
     )
 
-    print("DEBUG - token generated in /logged:")
-    print(access_token)
-
     refresh_token = crud.create_refresh_token(authenticated_user)
 
-    expires_in = crud.get_token_expiration(access_token)
-
-    print("expires_in:", expires_in)
+    logger.debug("Access token for %s expires in %ss", username, expires_in)
 
     # Get content for tunes table (assuming admin=False by default)
     is_admin = False
-    music_entries = crud.get_tunes_table_content(
-        db, authenticated_user, is_admin
+    music_entries = await run_in_threadpool(
+        crud.get_tunes_table_content, db, authenticated_user, is_admin
     )
 
     # Prepare response with template
-    response = templates.TemplateResponse(
+    response = _render_page(
         "tunes.html",
-        {
-            "request": request,
-            "username": username,
-            "ready_tunes": music_entries,
-            "expires_in": expires_in,
-        },
+        request,
+        username=username,
+        ready_tunes=music_entries,
+        expires_in=expires_in,
     )
 
     # Set tokens in HTTP-only cookies
@@ -264,7 +287,7 @@ async def login_user_from_form(
 
 
 @router.get("/logged", response_class=HTMLResponse)
-async def refresh_via_cookie(
+def refresh_via_cookie(
     request: Request, db: Session = Depends(database.get_db)
 ):
     refresh_token = request.cookies.get("refresh_token")
@@ -274,31 +297,31 @@ async def refresh_via_cookie(
             status_code=401, detail="No refresh token provided"
         )
 
-    user = crud.verify_refresh_token(refresh_token, db)
+    user = crud.verify_refresh_token_cached(refresh_token, db)
     if not user:
         raise HTTPException(
             status_code=401, detail="Invalid or expired refresh token"
         )
 
-    access_token = crud.create_access_token(
-        data={"sub": user.username, "version": user.token_version}
+    access_token, expires_in = crud.create_access_token_with_expiry(
+        data={
+            "sub": user.username,
+            "version": user.token_version,
+            "role": user.role,
+        }
     )
     new_refresh_token = crud.create_refresh_token(user)
 
-    expires_in = crud.get_token_expiration(access_token)
-
     music_entries = crud.get_tunes_table_content(
         db, user_authenticated=True, is_admin=False
     )
 
-    response = templates.TemplateResponse(
+    response = _render_page(
         "tunes.html",
-        {
-            "request": request,
-            "username": user.username,
-            "ready_tunes": music_entries,
-            "expires_in": expires_in,
-        },
+        request,
+        username=user.username,
+        ready_tunes=music_entries,
+        expires_in=expires_in,
     )
 
     response.set_cookie(
@@ -312,7 +335,7 @@ async def refresh_via_cookie(
 
 
 @router.get("/details/{tune_id}", name="details", response_class=HTMLResponse)
-async def tune_details(
+def tune_details(
     request: Request,
     tune_id: int,
     db: Session = Depends(database.get_db),
@@ -322,33 +345,30 @@ async def tune_details(
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    # Verify the token and get the logged-in user
-    user = crud.get_logged_in_user(db, token)
+    # Verify the token, get the logged-in user and the tune details
+    user, tune = crud.get_logged_in_user_and_tune(db, token, tune_id)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    # Fetch the tune details from the database
-    tune = crud.get_tune_by_id(db, tune_id)
-
     if tune is None or tune.link is None:
         raise HTTPException(status_code=404, detail="Tune not found")
 
     # Generate access token (can be refreshed here if needed)
-    access_token = crud.create_access_token(
-        data={"sub": user.username, "version": user.token_version}
+    access_token, expires_in = crud.create_access_token_with_expiry(
+        data={
+            "sub": user.username,
+            "version": user.token_version,
+            "role": user.role,
+        }
     )
 
-    expires_in = crud.get_token_expiration(access_token)
-
     # Prepare response with template
-    response = templates.TemplateResponse(
+    response = _render_page(
         "details.html",
-        {
-            "request": request,
-            "tune": tune,
-            "username": user.username,
-            "expires_in": expires_in,
-        },
+        request,
+        tune=tune,
+        username=user.username,
+        expires_in=expires_in,
     )
 
     # Set the new access token in HTTP-only cookies
@@ -360,7 +380,7 @@ async def tune_details(
 
 
 @router.get("/confirm")
-async def confirm_registration(
+def confirm_registration(
     request: Request, token: str, db: Session = Depends(database.get_db)
 ):
     """
@@ -371,7 +391,7 @@ async def confirm_registration(
     if not user_data:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
 
-    user = crud.get_user_by_username_or_email(db, username=user_data["sub"])
+    user = crud.get_user_by_username(db, user_data["sub"])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -379,19 +399,19 @@ async def confirm_registration(
     user.is_confirmed = True
     db.commit()
 
-    return templates.TemplateResponse("confirmed.html", {"request": request})
+    return _render_page("confirmed.html", request)
 
 
 @router.post("/refresh")
-async def refresh_token(
+def refresh_token(
     token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
 ):
     """
     Endpoint to refresh access and refresh tokens.
     Requires a valid refresh token.
     """
-    # Verify the refresh token and get the user
-    user = crud.verify_refresh_token(token, db)
+    # Verify the refresh token and retire it, so it can be used only once
+    user = crud.rotate_refresh_token(token, db)
     if not user:
         raise HTTPException(
             status_code=401, detail="Invalid or expired refresh token"
@@ -399,7 +419,11 @@ async def refresh_token(
 
     # Generate new tokens
     access_token = crud.create_access_token(
-        data={"sub": user.username, "version": user.token_version}
+        data={
+            "sub": user.username,
+            "version": user.token_version,
+            "role": user.role,
+        }
     )
     refresh_token = crud.create_refresh_token(user)
 
@@ -410,77 +434,99 @@ async def refresh_token(
     }
 
 
-@router.get("/music")
-async def get_music_table(
-    db: Session = Depends(database.get_db), token: str = Depends(oauth2_scheme)
-):
-    # Verify user via token
-    user = crud.get_logged_in_user(db, token)
-    user_authenticated = bool(user)
-    is_admin = user.role == "admin" if user else False
+# Last encoded body per music listing: (listing rows, body, etag)
+_music_bodies = {}
 
-    music_entries = crud.get_tunes_table_content(
-        db, user_authenticated, is_admin
-    )
 
+def _public_tune(record) -> dict:
+    return {
+        "title": record.title,
+        "composer": record.composer,
+        "rhythm": record.rhythm,
+        "link": record.link,
+        "description": record.description,
+    }
+
+
+def _admin_tune(record) -> dict:
+    # Admin rows hold exactly the columns to show
+    return record._asdict()
+
+
+def _music_response(request: Request, music_entries, key: str, to_dict):
+    """
+    Encodes a music listing once and reuses the body and its ETag
+    for as long as the listing cache hands out the same rows.
+    Answers 304 when the client already has this listing.
+    """
     if not music_entries:
         raise HTTPException(status_code=404, detail="No music records found")
 
-    if is_admin:
-        result = [
-            {
-                "id": record.id,
-                "title": record.title,
-                "composer": record.composer,
-                "rhythm": record.rhythm,
-                "link": record.link,
-                "description": record.description,
-                "demo": record.demo,
-                "progress": record.progress,
-            }
-            for record in music_entries
-        ]
-
-    else:
-        result = [
-            {
-                "title": record.title,
-                "composer": record.composer,
-                "rhythm": record.rhythm,
-                "link": record.link,
-                "description": record.description,
-            }
-            for record in music_entries
-        ]
-
-    return {"music_entries": result}
+    cached = _music_bodies.get(key)
+    if not cached or cached[0] is not music_entries:
+        result = [to_dict(record) for record in music_entries]
+        body = orjson.dumps({"music_entries": result})
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        cached = (music_entries, body, etag)
+        _music_bodies[key] = cached
+
+    body, etag = cached[1], cached[2]
+    # The listing depends on the bearer token, and a token can be logged
+    # out, so clients keep a copy per token and revalidate it every time
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Vary": "Authorization",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    return Response(body, media_type="application/json", headers=headers)
 
 
-@router.get("/me")
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
+@router.get("/music", response_model=schemas.MusicTable)
+def get_music_table(
+    request: Request,
+    db: Session = Depends(database.get_db),
+    user: crud.AuthUser = Depends(current_optional_user),
 ):
-    user = crud.get_logged_in_user(db, token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    """Tunes ready to listen to, or the demo tunes for invalid tokens"""
+    user_authenticated = bool(user)
+    music_entries = crud.get_tunes_table_content(
+        db, user_authenticated, is_admin=False
+    )
+    key = "ready" if user_authenticated else "demo"
+    return _music_response(request, music_entries, key, _public_tune)
+
 
+@router.get("/music/admin", response_model=schemas.AdminMusicTable)
+def get_admin_music_table(
+    request: Request,
+    db: Session = Depends(database.get_db),
+    admin: crud.AuthUser = Depends(current_admin),
+):
+    """All tunes with every column, for admins"""
+    music_entries = crud.get_tunes_table_content(
+        db, user_authenticated=True, is_admin=True
+    )
+    return _music_response(request, music_entries, "admin", _admin_tune)
+
+
+@router.get("/me")
+def get_current_user(user: crud.AuthUser = Depends(current_user)):
     return {"username": user.username, "email": user.email}
 
 
 @router.post("/proposals")
-async def add_proposal(
+def add_proposal(
     proposal: schemas.ProposalCreate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(oauth2_scheme),
+    user: crud.AuthUser = Depends(current_user),
 ):
     """
     Endpoint to add a new record to proposals table
     Available for users logged in
     """
-    user = crud.get_logged_in_user(db, token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
     # add a new record
     new_proposal = crud.create_proposal(db, proposal, user.id)
 
@@ -493,7 +539,7 @@ async def add_proposal(
 
 
 @router.post("/logout")
-async def logout_user(
+def logout_user(
     token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
 ):
     user = crud.get_logged_in_user(db, token)
@@ -507,18 +553,14 @@ async def logout_user(
 
 
 @router.get("/logout", name="logout")
-async def logout(request: Request):
+def logout(request: Request, db: Session = Depends(database.get_db)):
     access_token = request.cookies.get("access_token")
 
+    # Log out in-process rather than calling POST /logout over HTTP
     if access_token:
-        try:
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{BASE_URL}/logout",
-                    headers={"Authorization": f"Bearer {access_token}"},
-                )
-        except Exception as e:
-            print("Logout request failed:", e)
+        user = crud.get_logged_in_user(db, access_token)
+        if user:
+            crud.logout_user(db, user)
 
     response = RedirectResponse(url="/", status_code=302)
     response.delete_cookie("access_token")
@@ -527,16 +569,10 @@ async def logout(request: Request):
 
 
 @router.get("/proposals")
-async def get_proposals(
-    db: Session = Depends(database.get_db), token: str = Depends(oauth2_scheme)
+def get_proposals(
+    db: Session = Depends(database.get_db),
+    admin: crud.AuthUser = Depends(current_admin),
 ):
-    # verify admin user via token
-    user = crud.get_logged_in_user(db, token)
-    if not user or user.role != "admin":
-        raise HTTPException(
-            status_code=403, detail="Admin privileges required"
-        )
-
     proposal_entries = crud.get_proposal_content(db)
     if not proposal_entries:
         raise HTTPException(status_code=404, detail="No proposal found")
@@ -550,21 +586,17 @@ async def get_proposals(
         }
         for record in proposal_entries
     ]
-    return {"proposal_entries": result}
+    # Plain values only, so the jsonable_encoder pass is skipped
+    return ORJSONResponse({"proposal_entries": result})
 
 
 @router.post("/tunes")
-async def add_tune(
+def add_tune(
     tune: schemas.TuneCreate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(oauth2_scheme),
+    admin: crud.AuthUser = Depends(current_admin),
 ):
     """Endpoint for an admin that enables adding a new tune"""
-    user = crud.get_logged_in_user(db, token)
-    if not user or user.role != "admin":
-        raise HTTPException(
-            status_code=403, detail="Admin privileges required"
-        )
 
     new_tune = crud.create_tune(db, tune)
 
@@ -572,18 +604,13 @@ async def add_tune(
 
 
 @router.put("/tunes/{tune_id}")
-async def update_tune(
+def update_tune(
     tune_id: int,
     tune: schemas.TuneUpdate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(oauth2_scheme),
+    admin: crud.AuthUser = Depends(current_admin),
 ):
     """Endpoint for an admin, that enables to edit the tune based on its id"""
-    user = crud.get_logged_in_user(db, token)
-    if not user or user.role != "admin":
-        raise HTTPException(
-            status_code=403, detail="Admin privileges required"
-        )
 
     updated_tune = crud.update_tune(db, tune_id, tune)
     if not updated_tune:
@@ -593,8 +620,9 @@ async def update_tune(
 
 
 @router.post("/forgot-password/")
-async def forgot_password(
+def forgot_password(
     request: schemas.ForgotPasswordRequest,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(database.get_db),
 ):
     """Handles password reset requests"""
@@ -605,7 +633,8 @@ async def forgot_password(
     if not reset_token:
         raise HTTPException(status_code=404, detail="User not found")
 
-    await send_reset_password_email(email, reset_token)
+    # the email is sent after the response, SMTP latency is not awaited
+    background_tasks.add_task(send_reset_password_email, email, reset_token)
 
     return {
         "message": "Password reset email sent",
@@ -634,14 +663,7 @@ def reset_password(
     if not user:
         return {"error": "Invalid or expired token"}
 
-    # hash new password and save it to the database
-    hashed_password = crud.hash_password(request.new_password)
-    user.password = hashed_password
-
-    # delete the used token
-    user.reset_token = None
-    user.reset_token_expiry = None
-
-    db.commit()
+    # hash new password, save it and delete the used token
+    crud.update_password(db, user, request.new_password)
 
     return {"message": "Password reset successfully"}
@@ -1,13 +1,53 @@
 from pydantic import BaseModel, EmailStr, constr, validator
-from typing import Optional
+from typing import List, Optional
+from functools import lru_cache
 import re
 
+# Validation patterns, compiled once at import
+_USERNAME_RE = re.compile(r"^[a-zA-Z0-9_]+$")
+
+# Character classes a password must contain, as bit flags
+_UPPER, _LOWER, _DIGIT, _SPECIAL, _WHITESPACE = 1, 2, 4, 8, 16
+_PASSWORD_CHAR_CLASSES = {
+    **dict.fromkeys("ABCDEFGHIJKLMNOPQRSTUVWXYZ", _UPPER),
+    **dict.fromkeys("abcdefghijklmnopqrstuvwxyz", _LOWER),
+    **dict.fromkeys("0123456789", _DIGIT),
+    **dict.fromkeys('!@#$%^&*(),.?":{}|<>', _SPECIAL),
+}
+
+
+def _password_char_classes(value: str) -> int:
+    """Returns the character classes found in a password, in one pass."""
+    flags = 0
+    for char in value:
+        flag = _PASSWORD_CHAR_CLASSES.get(char)
+        if flag is not None:
+            flags |= flag
+        elif char.isspace():
+            flags |= _WHITESPACE
+    return flags
+
+
+@lru_cache(maxsize=4096)
+def _validate_email(value: str) -> str:
+    """Validates an address, invalid ones raise and are not remembered."""
+    return EmailStr.validate(value)
+
+
+class CachedEmailStr(EmailStr):
+    """EmailStr remembering recently validated addresses."""
+
+    @classmethod
+    def validate(cls, value: str) -> str:
+        return _validate_email(value)
+
+
 # Schema for registering a user, validated using Pydantic
 
 
 class UserRegister(BaseModel):
     username: str
-    email: EmailStr
+    email: CachedEmailStr
     password: str
 
     @validator("username")
@@ -16,7 +56,7 @@ class UserRegister(BaseModel):
             raise ValueError(
                 "Username length must be between 3 and 15 characters"
             )
-        if not re.match(r"^[a-zA-Z0-9_]+$", value):
+        if not _USERNAME_RE.match(value):
             raise ValueError(
                 "Username must contain only alphanumeric characters "
                 "or underscores"
@@ -29,21 +69,22 @@ class UserRegister(BaseModel):
             raise ValueError(
                 "Password length must be between 8 and 30 characters"
             )
-        if not re.search(r"[A-Z]", value):
+        flags = _password_char_classes(value)
+        if not flags & _UPPER:
             raise ValueError(
                 "Password must contain at least one uppercase letter"
             )
-        if not re.search(r"[a-z]", value):
+        if not flags & _LOWER:
             raise ValueError(
                 "Password must contain at least one lowercase letter"
             )
-        if not re.search(r"[0-9]", value):
+        if not flags & _DIGIT:
             raise ValueError("Password must contain at least one number")
-        if not re.search(r'[!@#$%^&*(),.?":{}|<>]', value):
+        if not flags & _SPECIAL:
             raise ValueError(
                 "Password must contain at least one special character"
             )
-        if re.search(r"\s", value):
+        if flags & _WHITESPACE:
             raise ValueError("Password must not contain whitespace characters")
         return value
 
@@ -54,7 +95,7 @@ class UserLogin(BaseModel):
 
     @validator("username")
     def validate_username(cls, value):
-        if not re.match(r"^[a-zA-Z0-9_]+$", value):
+        if not _USERNAME_RE.match(value):
             raise ValueError(
                 "Username must only contain alphanumeric characters "
                 "or underscores"
@@ -129,6 +170,28 @@ class Tune(TuneCreate):
         orm_mode = True
 
 
+class TuneOut(BaseModel):
+    title: str
+    composer: Optional[str]
+    rhythm: Optional[str]
+    link: Optional[str]
+    description: Optional[str]
+
+
+class TuneAdminOut(TuneOut):
+    id: int
+    demo: Optional[bool]
+    progress: Optional[int]
+
+
+class MusicTable(BaseModel):
+    music_entries: List[TuneOut]
+
+
+class AdminMusicTable(BaseModel):
+    music_entries: List[TuneAdminOut]
+
+
 class ProposalCreate(BaseModel):
     title: constr(min_length=1, max_length=30)
     composer: Optional[constr(min_length=1, max_length=30)]
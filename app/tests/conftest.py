@@ -0,0 +1,66 @@
+import os
+
+# app.config refuses to load without a JWT secret key
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+# One hashing process per test worker, pytest-xdist already uses every core
+os.environ.setdefault("KDF_WORKERS", "1")
+
+import pytest  # noqa: E402
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from app.models import Base  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """Fixture to set up one in-memory SQLite database for the whole run."""
+    # One shared connection, so every checkout (and thread) sees the schema
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself, pysqlite's own
+        # transaction handling breaks SAVEPOINTs
+        dbapi_connection.isolation_level = None
+        # Enable foreign key support for SQLite
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        # Test data need not survive a crash, skip syncs and temp files
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def do_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    # Create tables once
+    Base.metadata.create_all(engine)
+
+    yield engine
+
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    """
+    Fixture to provide a session whose changes are rolled back after the test.
+    Commits in the test only release a SAVEPOINT of the outer transaction.
+    """
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = Session(
+        bind=connection, join_transaction_mode="create_savepoint"
+    )
+
+    yield session  # Provide the session to tests
+
+    session.close()
+    transaction.rollback()
+    connection.close()
@@ -0,0 +1,475 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from app import crud, schemas
+from app.models import User, Tunes
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Fixture to start every test with empty caches."""
+    crud._token_cache.clear()
+    crud.clear_listing_cache()
+    crud._password_cache.clear()
+    crud._refresh_cache.clear()
+    crud._auth_user_cache.clear()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def kdf_pool():
+    """Fixture to stop the password hashing processes after the tests."""
+    yield
+    crud.shutdown_kdf_pool()
+
+
+def seed_users(session, *rows):
+    """Inserts users with one executemany, skipping the unit of work."""
+    session.execute(
+        insert(User),
+        [
+            {
+                "email": f"{row['username']}@example.com",
+                "password": "securepassword",
+                **row,
+            }
+            for row in rows
+        ],
+    )
+
+
+def authenticate(session, username, password):
+    """Runs the async authenticate_user to completion."""
+    return asyncio.run(crud.authenticate_user(session, username, password))
+
+
+def test_verify_token_returns_payload():
+    """Test that a freshly created token is decoded correctly."""
+    token = crud.create_access_token(data={"sub": "testuser", "version": 3})
+
+    payload = crud.verify_token(token)
+
+    assert payload is not None
+    assert payload["sub"] == "testuser"
+    assert payload["version"] == 3
+
+
+def test_verify_token_uses_cache(monkeypatch):
+    """Test that a repeated verification does not decode the token again."""
+    token = crud.create_access_token(data={"sub": "testuser"})
+    crud.verify_token(token)
+
+    def fail_decode(*args, **kwargs):
+        raise AssertionError("jwt.decode should not be called")
+
+    monkeypatch.setattr(crud._jwt_decoder, "decode", fail_decode)
+
+    assert crud.verify_token(token)["sub"] == "testuser"
+
+
+def test_create_access_token_with_expiry():
+    """Test that the returned lifetime matches the token's own expiry."""
+    token, expires_in = crud.create_access_token_with_expiry(
+        data={"sub": "testuser"}, expires_delta=timedelta(minutes=5)
+    )
+
+    assert expires_in == 300
+    expires_at = crud.verify_token(token)["exp"]
+    assert abs(expires_at - crud.time.time() - expires_in) <= 1
+
+
+def test_verify_token_rejects_invalid_token():
+    """Test that a malformed token is rejected."""
+    assert crud.verify_token("not-a-token") is None
+
+
+def test_verify_token_allows_expired_token():
+    """Test that an expired token is only accepted with allow_expired."""
+    token = crud.create_access_token(
+        data={"sub": "testuser"}, expires_delta=timedelta(minutes=-1)
+    )
+
+    assert crud.verify_token(token) is None
+    assert crud.verify_token(token, allow_expired=True)["sub"] == "testuser"
+
+
+def test_authenticate_user(session):
+    """Test authentication with a correct and an incorrect password."""
+    session.add(
+        User(
+            username="authuser",
+            email="authuser@example.com",
+            password=crud.hash_password("Secret123!"),
+        )
+    )
+    session.commit()
+
+    assert authenticate(session, "authuser", "Secret123!")
+    assert authenticate(session, "authuser", "Wrong123!") is None
+
+
+def test_authenticate_user_keeps_callers_changes(session):
+    """Test that authenticating does not drop the caller's pending work."""
+    session.add(
+        User(
+            username="pendinguser",
+            email="pendinguser@example.com",
+            password=crud.hash_password("Secret123!"),
+        )
+    )
+    session.commit()
+    tune = Tunes(title="Pending tune")
+    session.add(tune)
+
+    assert authenticate(session, "pendinguser", "Secret123!")
+
+    assert tune in session
+    session.commit()
+    assert session.query(Tunes).filter_by(title="Pending tune").count() == 1
+
+
+def test_verify_password_caches_only_matches(monkeypatch):
+    """Test that a correct password is verified by the KDF only once."""
+    hashed_password = crud.hash_password("Secret123!")
+    calls = []
+
+    async def run_in_process(func, *args):
+        calls.append(args)
+        return func(*args)
+
+    monkeypatch.setattr(crud, "_run_in_kdf_pool", run_in_process)
+
+    def verify(password):
+        return asyncio.run(
+            crud.verify_password_async(password, hashed_password)
+        )
+
+    assert verify("Secret123!")
+    assert verify("Secret123!")
+    assert not verify("Wrong123!")
+    assert not verify("Wrong123!")
+
+    assert len(calls) == 3
+
+
+def test_kdf_pool_recovers_from_dead_worker():
+    """Test that a killed hashing process does not break later logins."""
+    hashed_password = asyncio.run(crud.hash_password_async("Secret123!"))
+    pool = crud._kdf_pool()
+    for process in list(pool._processes.values()):
+        process.kill()
+        process.join()
+
+    assert asyncio.run(
+        crud.verify_password_async("Secret123!", hashed_password)
+    )
+    assert crud._kdf_pool() is not pool
+
+
+def test_logout_forgets_verified_password(session):
+    """Test that logging out drops the user's cached password check."""
+    user = User(
+        username="logoutuser",
+        email="logoutuser@example.com",
+        password=crud.hash_password("Secret123!"),
+    )
+    session.add(user)
+    session.commit()
+    asyncio.run(crud.verify_password_async("Secret123!", user.password))
+
+    crud.logout_user(session, user)
+
+    assert len(crud._password_cache) == 0
+
+
+def test_authenticate_user_upgrades_bcrypt_hash(session):
+    """Test that a legacy bcrypt hash is replaced by Argon2id on login."""
+    bcrypt_hash = crud.bcrypt.hashpw(
+        b"Secret123!", crud.bcrypt.gensalt(4)
+    ).decode()
+    session.add(
+        User(
+            username="legacyuser",
+            email="legacyuser@example.com",
+            password=bcrypt_hash,
+        )
+    )
+    session.commit()
+
+    user = authenticate(session, "legacyuser", "Secret123!")
+
+    assert user.password.startswith("$argon2id$")
+    assert authenticate(session, "legacyuser", "Secret123!")
+
+
+def test_authenticate_user_with_malformed_hash(session):
+    """Test that a stored hash that is neither Argon2 nor bcrypt fails."""
+    session.add(
+        User(
+            username="brokenhash",
+            email="brokenhash@example.com",
+            password="not-a-hash",
+        )
+    )
+    session.commit()
+
+    assert authenticate(session, "brokenhash", "Secret123!") is None
+
+
+def test_authenticate_unknown_user(session):
+    """Test that an unknown user is rejected."""
+    assert authenticate(session, "nobody", "Secret123!") is None
+
+
+def test_dummy_password_hash_is_built_once():
+    """Test that unknown users are all checked against one Argon2 hash."""
+    dummy_hash = asyncio.run(crud.dummy_password_hash())
+    assert dummy_hash.startswith("$argon2id$")
+    assert asyncio.run(crud.dummy_password_hash()) is dummy_hash
+
+
+def test_create_user_skips_taken_username_or_email(session):
+    """Test that a taken username or email does not create a user."""
+    user_data = schemas.UserRegister(
+        username="takenuser",
+        email="takenuser@example.com",
+        password="Secret123!",
+    )
+
+    new_user = crud.create_user(session, user_data, "hashed")
+
+    assert new_user is not None
+    assert new_user.id is not None
+    assert not new_user.is_confirmed
+
+    same_username = user_data.copy(update={"email": "other@example.com"})
+    same_email = user_data.copy(update={"username": "otheruser"})
+
+    assert crud.create_user(session, same_username, "hashed") is None
+    assert crud.create_user(session, same_email, "hashed") is None
+
+
+def test_create_user_needs_no_reload(session, engine):
+    """Test that reading the new user does not query the database again."""
+    user_data = schemas.UserRegister(
+        username="loadeduser",
+        email="loadeduser@example.com",
+        password="Secret123!",
+    )
+    new_user = crud.create_user(session, user_data, "hashed")
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = schemas.UserResponse.from_orm(new_user)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert response.username == "loadeduser"
+    assert statements == []
+
+
+def test_remove_unconfirmed_users(session):
+    """Test that only old unconfirmed users are removed."""
+    two_hours_ago = datetime.utcnow() - timedelta(hours=2)
+
+    seed_users(
+        session,
+        {"username": "staleuser", "created_at": two_hours_ago},
+        {
+            "username": "confirmeduser",
+            "is_confirmed": True,
+            "created_at": two_hours_ago,
+        },
+    )
+
+    crud.remove_unconfirmed_users(session)
+
+    assert session.query(User).filter_by(username="staleuser").count() == 0
+    assert session.query(User).filter_by(username="confirmeduser").count() == 1
+
+
+def test_access_token_is_valid_jwt():
+    """Test that the HS256 encoder produces tokens PyJWT can verify."""
+    token = crud.create_access_token(data={"sub": "testuser", "version": 1})
+
+    payload = crud.jwt.decode(
+        token, crud.SECRET_KEY_BYTES, algorithms=[crud.ALGORITHM]
+    )
+
+    assert payload["sub"] == "testuser"
+    assert payload["version"] == 1
+    assert isinstance(payload["exp"], int)
+
+
+def test_get_tunes_table_content(session):
+    """Test which tunes are listed for each kind of user."""
+    session.add_all(
+        [
+            Tunes(title="Demo", link="demo-link", progress=50, demo=True),
+            Tunes(title="Ready", link="ready-link", progress=95),
+            Tunes(title="Draft", link="", progress=20),
+        ]
+    )
+    session.commit()
+
+    def titles(user_authenticated, is_admin):
+        records = crud.get_tunes_table_content(
+            session, user_authenticated, is_admin
+        )
+        return {record.title for record in records}
+
+    assert titles(False, True) == {"Demo", "Ready", "Draft"}
+    assert titles(True, False) == {"Ready"}
+    assert titles(False, False) == {"Demo"}
+
+
+def test_create_tune_clears_listing_cache(session):
+    """Test that a new tune shows up although the listing was cached."""
+    before = crud.get_tunes_table_content(session, False, True)
+
+    crud.create_tune(session, schemas.TuneCreate(title="New tune"))
+
+    after = crud.get_tunes_table_content(session, False, True)
+    assert len(after) == len(before) + 1
+
+
+def test_update_tune(session):
+    """Test that only the fields sent with a value are updated."""
+    tune = crud.create_tune(
+        session, schemas.TuneCreate(title="Old title", composer="Composer")
+    )
+
+    updated = crud.update_tune(
+        session, tune.id, schemas.TuneUpdate(title="New title", progress=40)
+    )
+
+    assert updated.id == tune.id
+    assert updated.title == "New title"
+    assert updated.composer == "Composer"
+    assert updated.progress == 40
+
+
+def test_update_missing_tune(session):
+    """Test that updating a missing tune returns None."""
+    tune_data = schemas.TuneUpdate(title="Missing")
+
+    assert crud.update_tune(session, 9999, tune_data) is None
+
+
+def test_refresh_token_is_valid_until_logout(session):
+    """Test that a remembered refresh token is forgotten on logout."""
+    user = User(
+        username="refreshuser",
+        email="refreshuser@example.com",
+        password="securepassword",
+    )
+    session.add(user)
+    session.commit()
+    refresh_token = crud.create_refresh_token(user)
+
+    assert crud.refresh_token_is_valid(refresh_token, session)
+    assert crud.refresh_token_is_valid(refresh_token, session)
+
+    crud.logout_user(session, user)
+
+    assert not crud.refresh_token_is_valid(refresh_token, session)
+
+
+def test_rotate_refresh_token_accepts_token_once(session):
+    """Test that a rotated refresh token cannot be used again."""
+    user = User(
+        username="rotateuser",
+        email="rotateuser@example.com",
+        password="securepassword",
+    )
+    session.add(user)
+    session.commit()
+    refresh_token = crud.create_refresh_token(user)
+
+    rotated = crud.rotate_refresh_token(refresh_token, session)
+    assert rotated.username == "rotateuser"
+    assert rotated.refresh_token_version == 1
+
+    assert crud.rotate_refresh_token(refresh_token, session) is None
+    new_token = crud.create_refresh_token(rotated)
+    assert crud.rotate_refresh_token(new_token, session) is not None
+
+
+def test_logged_in_user_is_cached_until_logout(session, monkeypatch):
+    """Test that a token's user is looked up once and forgotten on logout."""
+    user = User(
+        username="cacheduser",
+        email="cacheduser@example.com",
+        password="securepassword",
+    )
+    session.add(user)
+    session.commit()
+    token = crud.create_access_token(
+        data={"sub": user.username, "version": user.token_version}
+    )
+
+    cached = crud.get_logged_in_user_cached(session, token)
+    assert cached.id == user.id
+    assert cached.email == "cacheduser@example.com"
+
+    def fail_lookup(*args, **kwargs):
+        raise AssertionError("the user should come from the cache")
+
+    monkeypatch.setattr(crud, "get_user_for_auth", fail_lookup)
+    assert crud.get_logged_in_user_cached(session, token) == cached
+
+    monkeypatch.undo()
+    crud.logout_user(session, user)
+
+    assert crud.get_logged_in_user_cached(session, token) is None
+
+
+def test_get_logged_in_user_and_tune(session):
+    """Test that the user and the tune are fetched, and the user cached."""
+    user = User(
+        username="detailsuser",
+        email="detailsuser@example.com",
+        password="securepassword",
+    )
+    tune = Tunes(title="Details", link="details-link", progress=95)
+    session.add_all([user, tune])
+    session.commit()
+    token = crud.create_access_token(
+        data={"sub": user.username, "version": user.token_version}
+    )
+
+    found_user, found_tune = crud.get_logged_in_user_and_tune(
+        session, token, tune.id
+    )
+    assert found_user.id == user.id
+    assert found_tune.title == "Details"
+
+    # A missing tune still yields the user, now from the cache
+    assert crud.get_logged_in_user_and_tune(session, token, -1) == (
+        found_user,
+        None,
+    )
+    assert crud.get_logged_in_user_and_tune(
+        session, "not-a-token", tune.id
+    ) == (None, None)
+
+
+def test_reset_token_round_trip(session):
+    """Test that a generated reset token is accepted and a wrong one is not."""
+    seed_users(
+        session, {"username": "resetuser"}, {"username": "otherresetuser"}
+    )
+
+    crud.generate_reset_token(session, "otherresetuser@example.com")
+    reset_token = crud.generate_reset_token(session, "resetuser@example.com")
+
+    user = crud.verify_reset_token(session, reset_token)
+    assert user is not None
+    assert user.username == "resetuser"
+    assert user.reset_token != reset_token
+    assert crud.verify_reset_token(session, "wrong-token") is None
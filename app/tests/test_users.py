@@ -7,43 +7,24 @@
 #     )
 # )
 
-import pytest
-from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker
-from app.models import User, Proposals, Base
+from app.models import User, Proposals
 
 
-@pytest.fixture(scope="module")
-def setup_database():
-    """Fixture to set up the in-memory SQLite database and session."""
-    # Create an in-memory SQLite database
-    engine = create_engine("sqlite:///:memory:")
-
-    # Enable foreign key support for SQLite
-    @event.listens_for(engine, "connect")
-    def set_sqlite_foreign_keys(dbapi_connection, connection_record):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.close()
-
-    # Create tables
-    Base.metadata.create_all(engine)
-
-    # Create a session factory
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    yield session  # Provide the session to tests
-
-    # Clean up after tests
-    session.close()
-    engine.dispose()
+def make_user_with_proposal(session, username, **proposal_fields):
+    """Adds a user and their proposal with a single flush."""
+    user = User(
+        username=username,
+        email=f"{username}@example.com",
+        password="securepassword",
+    )
+    proposal = Proposals(user=user, **proposal_fields)
+    session.add_all([user, proposal])
+    session.flush()
+    return user, proposal
 
 
-def test_create_user(setup_database):
+def test_create_user(session):
     """Test the creation of a user."""
-    session = setup_database
-
     # Create a test user
     new_user = User(
         username="testuser",
@@ -51,7 +32,7 @@ def test_create_user(setup_database):
         password="securepassword",
     )
     session.add(new_user)
-    session.commit()
+    session.flush()
 
     # Retrieve the user from the database
     saved_user = session.query(User).filter_by(username="testuser").first()
@@ -61,28 +42,16 @@ def test_create_user(setup_database):
     assert saved_user.email == "testuser@example.com"
 
 
-def test_create_proposal(setup_database):
+def test_create_proposal(session):
     """Test the creation of a proposal."""
-    session = setup_database
-
-    # Create a test user
-    new_user = User(
-        username="testuser2",
-        email="testuser2@example.com",
-        password="securepassword",
-    )
-    session.add(new_user)
-    session.commit()
-
-    # Create a proposal for the user
-    new_proposal = Proposals(
-        user_id=new_user.id,
+    # Create a test user with a proposal
+    new_user, _ = make_user_with_proposal(
+        session,
+        "testuser2",
         title="Test Proposal",
         composer="Test Composer",
         info="Some info",
     )
-    session.add(new_proposal)
-    session.commit()
 
     # Retrieve the proposal from the database
     saved_proposal = (
@@ -95,28 +64,16 @@ def test_create_proposal(setup_database):
     assert saved_proposal.user_id == new_user.id
 
 
-def test_relationship_between_user_and_proposal(setup_database):
+def test_relationship_between_user_and_proposal(session):
     """Test the relationship between a user and a proposal."""
-    session = setup_database
-
-    # Create a test user
-    new_user = User(
-        username="testuser3",
-        email="testuser3@example.com",
-        password="securepassword",
-    )
-    session.add(new_user)
-    session.commit()
-
-    # Create a proposal for the user
-    new_proposal = Proposals(
-        user_id=new_user.id,
+    # Create a test user with a proposal
+    make_user_with_proposal(
+        session,
+        "testuser3",
         title="Proposal for Relationship Test",
         composer="Composer X",
         info="Info X",
     )
-    session.add(new_proposal)
-    session.commit()
 
     # Retrieve the user and their proposal
     saved_user = session.query(User).filter_by(username="testuser3").first()
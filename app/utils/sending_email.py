@@ -1,61 +1,160 @@
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from pydantic import EmailStr
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-# SMTP configuration
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("EMAIL_USER"),
-    MAIL_PASSWORD=os.getenv("EMAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("EMAIL_USER"),
-    MAIL_PORT=int(os.getenv("EMAIL_PORT", 587)),
-    MAIL_SERVER=os.getenv("EMAIL_HOST"),
-    MAIL_TLS=os.getenv("EMAIL_USE_SSL", "False").lower() != "true",
-    MAIL_SSL=os.getenv("EMAIL_USE_SSL", "False").lower() == "true",
-    MAIL_FROM_NAME="accordion.jakub-kuba.com",
+from email.message import EmailMessage
+from email.utils import formataddr
+from string import Template
+from app.config import (
+    BASE_URL,
+    EMAIL_HOST,
+    EMAIL_PORT,
+    EMAIL_USER,
+    EMAIL_PASSWORD,
+    EMAIL_USE_SSL,
+    EMAIL_POOL_SIZE,
+    EMAIL_MAX_MESSAGES,
 )
+import aiosmtplib
+import asyncio
 
+# Name shown as the sender of outgoing emails
+MAIL_FROM_NAME = "accordion.jakub-kuba.com"
 
-async def send_confirmation_email(email: EmailStr, confirmation_link: str):
-    message = MessageSchema(
-        subject="Registration confirmation",
-        recipients=[email],
-        html=(
-            "Thank you for registering in my application! "
-            "Please confirm your registration by clicking the following link: "
-            f"<a href='{confirmation_link}'>Confirm Registration</a>. "
-            "If you do not confirm your email within one hour, "
-            "your account will be deleted."
-        ),
-        subtype="html",
+# Seconds to wait for the SMTP server
+SMTP_TIMEOUT = 30
+
+
+async def _open_smtp() -> aiosmtplib.SMTP:
+    """Connects and logs in to the SMTP server."""
+    smtp = aiosmtplib.SMTP(
+        hostname=EMAIL_HOST,
+        port=EMAIL_PORT,
+        use_tls=EMAIL_USE_SSL,
+        timeout=SMTP_TIMEOUT,
     )
+    await smtp.connect()
+    try:
+        if not EMAIL_USE_SSL:
+            await smtp.starttls()
+        await smtp.login(EMAIL_USER, EMAIL_PASSWORD)
+    except BaseException:
+        # Don't leak the connection when STARTTLS or the login fails
+        smtp.close()
+        raise
+    return smtp
+
+
+async def _quit_smtp(smtp: aiosmtplib.SMTP):
+    """Ends an SMTP session, dropping the connection if QUIT fails."""
+    if not smtp.is_connected:
+        return
+    try:
+        await smtp.quit()
+    except aiosmtplib.SMTPException:
+        smtp.close()
+
+
+class SMTPPool:
+    """
+    Logged-in SMTP sessions shared by concurrent sends.
+    At most `size` sessions are open at once, and each one
+    is replaced after it has sent `max_messages` messages.
+    """
+
+    def __init__(self, size: int, max_messages: int):
+        self.size = size
+        self.max_messages = max_messages
+        # Idle sessions with the number of messages they have sent
+        self._idle = []
+        # Created on first use, so it belongs to the running event loop
+        self._slots = None
+
+    async def send(self, message: EmailMessage):
+        """
+        Sends a message over an idle session or a new one,
+        reconnecting once if the server has dropped the session.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+
+        async with self._slots:
+            smtp, sent = self._idle.pop() if self._idle else (None, 0)
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp, sent = await _open_smtp(), 0
+                try:
+                    await smtp.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    smtp, sent = await _open_smtp(), 0
+                    await smtp.send_message(message)
+            except BaseException:
+                # The session may be mid-transaction, don't reuse it
+                if smtp is not None:
+                    smtp.close()
+                raise
+
+            sent += 1
+            if sent >= self.max_messages:
+                await _quit_smtp(smtp)
+            else:
+                self._idle.append((smtp, sent))
+
+    async def close(self):
+        """Ends all idle sessions."""
+        idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            await _quit_smtp(smtp)
+
+
+smtp_pool = SMTPPool(EMAIL_POOL_SIZE, EMAIL_MAX_MESSAGES)
 
-    fm = FastMail(conf)
-    await fm.send_message(message)
+
+async def close_smtp():
+    """Ends the pooled SMTP sessions."""
+    await smtp_pool.close()
+
+
+# Email bodies, only the link is filled in per message
+_CONFIRMATION_HTML = Template(
+    "Thank you for registering in my application! "
+    "Please confirm your registration by clicking the following link: "
+    "<a href='$link'>Confirm Registration</a>. "
+    "If you do not confirm your email within one hour, "
+    "your account will be deleted."
+)
+_RESET_HTML = Template(
+    "Someone (hopefully you) requested a password reset. "
+    "Click the link below to reset your password: "
+    "<a href='$link'>Reset Password</a>. "
+    "This link is valid for 1 hour."
+)
+
+
+async def send_html_email(to: EmailStr, subject: str, html: str):
+    """Sends an HTML email over the pooled SMTP sessions."""
+    message = EmailMessage()
+    message["From"] = formataddr((MAIL_FROM_NAME, EMAIL_USER))
+    message["To"] = to
+    message["Subject"] = subject
+    message.set_content(html, subtype="html")
+
+    await smtp_pool.send(message)
+
+
+async def send_confirmation_email(email: EmailStr, confirmation_link: str):
+    await send_html_email(
+        email,
+        "Registration confirmation",
+        _CONFIRMATION_HTML.substitute(link=confirmation_link),
+    )
 
 
 def generate_reset_link(reset_token: str) -> str:
     """Generates a password reset link"""
-    BASE_URL = os.getenv("BASE_URL")
     return f"{BASE_URL}/users/reset-password?token={reset_token}"
 
 
 async def send_reset_password_email(email: EmailStr, reset_token: str):
     """Sends an email with a link to reset your password"""
     reset_link = generate_reset_link(reset_token)
-    message = MessageSchema(
-        subject="Reset Password",
-        recipients=[email],
-        html=(
-            "Someone (hopefully you) requested a password reset. "
-            "Click the link below to reset your password: "
-            f"<a href='{reset_link}'>Reset Password</a>. "
-            "This link is valid for 1 hour."
-        ),
-        subtype="html",
+    await send_html_email(
+        email, "Reset Password", _RESET_HTML.substitute(link=reset_link)
     )
-
-    fm = FastMail(conf)
-    await fm.send_message(message)